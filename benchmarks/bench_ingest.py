@@ -0,0 +1,110 @@
+"""
+Benchmark the ingest path (load, merge, clean) of src/data_preprocessing.
+
+Builds a synthetic transactions CSV of the requested size from the sample
+in data/raw, then times the previous two-merge / astype(str) path against
+the current one and reports rows/sec.
+
+    python -m benchmarks.bench_ingest [rows]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data_preprocessing import (
+    CARDS_PATH,
+    TRANSACTIONS_PATH,
+    USERS_PATH,
+    clean_data,
+    load_raw_data,
+    merge_data,
+)
+
+DEFAULT_ROWS = 1_000_000
+
+
+def make_transactions_csv(path, rows, seed=0, whole_amounts=False):
+    rng = np.random.default_rng(seed)
+    sample = pd.read_csv(TRANSACTIONS_PATH)
+    cards = pd.read_csv(CARDS_PATH, usecols=["id", "client_id"])
+
+    df = sample.sample(rows, replace=True, random_state=seed).reset_index(drop=True)
+    df["id"] = np.arange(rows)
+
+    picked = rng.integers(0, len(cards), rows)
+    df["card_id"] = cards["id"].values[picked]
+    df["client_id"] = cards["client_id"].values[picked]
+
+    amounts = rng.normal(50, 80, rows)
+    if whole_amounts:
+        # e.g. "$14.00": numerically whole, but still float literals
+        amounts = amounts.round()
+    df["amount"] = [f"${x:.2f}" for x in amounts]
+    seconds = pd.to_timedelta(rng.integers(0, 300_000_000, rows), unit="s")
+    df["date"] = (pd.Timestamp("2010-01-01") + seconds).strftime("%Y-%m-%d %H:%M:%S")
+
+    df.to_csv(path, index=False)
+
+
+def legacy_ingest(transactions_path):
+    """The ingest path before converters and the single-pass join."""
+    transactions = pd.read_csv(transactions_path)
+    cards = pd.read_csv(CARDS_PATH).rename(columns={"id": "card_id_ref"})
+    users = pd.read_csv(USERS_PATH).rename(columns={"id": "user_id_ref"})
+
+    df = transactions.merge(
+        cards.drop(columns=["client_id"], errors="ignore"),
+        left_on="card_id", right_on="card_id_ref", how="left",
+    )
+    df = df.merge(users, left_on="client_id", right_on="user_id_ref", how="left")
+
+    df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    for col in ["amount", "credit_limit", "per_capita_income", "yearly_income", "total_debt"]:
+        df[col] = df[col].astype(str).str.replace("$", "", regex=False)
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    return df[df["amount"].notnull()]
+
+
+def fast_ingest(transactions_path):
+    t, c, u = load_raw_data(transactions_path=transactions_path)
+    return clean_data(merge_data(t, c, u))
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "transactions.csv")
+        make_transactions_csv(path, rows)
+
+        before, before_s = timed(legacy_ingest, path)
+        after, after_s = timed(fast_ingest, path)
+        pd.testing.assert_frame_equal(before.reset_index(drop=True), after.reset_index(drop=True))
+
+        # Dtypes must also match when every amount happens to be whole
+        whole_path = os.path.join(tmp, "transactions_whole.csv")
+        make_transactions_csv(whole_path, min(rows, 1000), whole_amounts=True)
+        pd.testing.assert_frame_equal(
+            legacy_ingest(whole_path).reset_index(drop=True),
+            fast_ingest(whole_path).reset_index(drop=True),
+        )
+
+    print(f"rows: {rows}")
+    print(f"before: {before_s:.2f}s ({rows / before_s:,.0f} rows/sec)")
+    print(f"after:  {after_s:.2f}s ({rows / after_s:,.0f} rows/sec)")
+    print(f"speedup: {before_s / after_s:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
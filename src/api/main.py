@@ -1,7 +1,7 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 import uuid
 import json
 import os
@@ -10,6 +10,8 @@ import asyncio
 from src.pipeline import full_pipeline
 from src.llm_reasoner import generate_reasoning
 from src.verifier import verify_reasoning
+from src import run_store, run_query
+from src.distributed import parse_workers, run_sharded_pipeline, worker_authkey
 
 app = FastAPI(title="Verifiable CoT Arbiter Backend")
 
@@ -22,9 +24,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-OUTPUT_DIR = "outputs/verified_chains"
+OUTPUT_DIR = run_store.RUNS_DIR
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Comma-separated host:port list of pipeline workers (see src/distributed.py).
+# When unset, the pipeline runs in-process.
+PIPELINE_WORKERS = os.getenv("PIPELINE_WORKERS")
+# Seconds to wait for one shard before retrying it on another worker
+PIPELINE_WORKER_TIMEOUT = float(os.getenv("PIPELINE_WORKER_TIMEOUT", "3600"))
+if PIPELINE_WORKERS:
+    # Refuse to start without the shared worker key
+    worker_authkey()
+
 # -----------------------------
 # Models
 # -----------------------------
@@ -34,6 +45,41 @@ class RunPipelineResponse(BaseModel):
     flagged_transactions: int
 
 
+# -----------------------------
+# HTTP caching
+# -----------------------------
+# Completed runs never change, so responses about them can be cached by
+# clients and revalidated with If-None-Match against an ETag of the run ids.
+RUN_CACHE_CONTROL = "public, max-age=86400, immutable"
+
+
+def _run_etag(*run_ids):
+    return '"' + ":".join(run_ids) + '"'
+
+
+def _cache_headers(*run_ids):
+    return {"ETag": _run_etag(*run_ids), "Cache-Control": RUN_CACHE_CONTROL}
+
+
+def _not_modified(request: Request, *run_ids):
+    """Return a 304 response if the client's cached copy is current, else None."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    if "*" in tags or _run_etag(*run_ids) in tags:
+        return Response(status_code=304, headers=_cache_headers(*run_ids))
+    return None
+
+
+def _cacheable(response: Response, result, *run_ids):
+    """Mark a successful run response as cacheable. Errors are left uncached."""
+    if not (isinstance(result, dict) and "error" in result):
+        response.headers.update(_cache_headers(*run_ids))
+    return result
+
+
 # -----------------------------
 # Routes
 # -----------------------------
@@ -42,14 +88,17 @@ class RunPipelineResponse(BaseModel):
 def run_pipeline():
     run_id = str(uuid.uuid4())
 
-    results = full_pipeline()
+    if PIPELINE_WORKERS:
+        results, metadata = run_sharded_pipeline(
+            parse_workers(PIPELINE_WORKERS), timeout=PIPELINE_WORKER_TIMEOUT
+        )
+    else:
+        results, metadata = full_pipeline(), {"mode": "local"}
 
     flagged = [r for r in results if r["rules"]]
 
-    # Save run output
-    output_path = os.path.join(OUTPUT_DIR, f"{run_id}.json")
-    with open(output_path, "w") as f:
-        json.dump(results, f, indent=2)
+    # Save run output together with its transaction-id index
+    run_store.save_run(run_id, results, metadata=metadata)
 
     return {
         "run_id": run_id,
@@ -60,137 +109,313 @@ def run_pipeline():
 
 @app.get("/api/runs")
 def list_runs():
-    files = [f for f in os.listdir(OUTPUT_DIR) if f.endswith('.json')]
-    # Return files sorted by modification time (newest first)
-    files.sort(key=lambda f: os.path.getmtime(os.path.join(OUTPUT_DIR, f)), reverse=True)
-    return files
+    # Return run files sorted by modification time (newest first)
+    return [f"{run_id}.json" for run_id in run_store.list_run_ids()]
 
 
 @app.get("/api/run/{run_id}/summary")
-async def get_run_summary(run_id: str):
+async def get_run_summary(run_id: str, request: Request, response: Response):
     """Get summary statistics without loading full data"""
-    path = os.path.join(OUTPUT_DIR, f"{run_id}.json")
-    if not os.path.exists(path):
+    if not run_store.run_exists(run_id):
         return {"error": "Run not found"}
-    
-    file_size = os.path.getsize(path)
-    
+
+    not_modified = _not_modified(request, run_id)
+    if not_modified:
+        return not_modified
+
     def get_summary():
         try:
-            # Only read first and last few lines to estimate, or read full file if small
-            if file_size > 10 * 1024 * 1024:  # > 10MB
-                # For large files, we need to load to count, but we'll limit this
-                return {"error": "File too large. Use pagination with small limits."}, None
-            
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if not isinstance(data, list):
-                return {"error": "Invalid data format"}, None
-            
-            total = len(data)
-            flagged_count = sum(1 for r in data if r.get("rules"))
-            
+            if run_store.is_legacy_run(run_id):
+                index = run_store.load_index(run_id)
+                total = len(index["transaction_id"])
+                flagged_count = sum(1 for rules in index["rules"] if rules)
+            else:
+                manifest = run_store.load_manifest(run_id)
+                total = manifest["total_transactions"]
+                flagged_count = manifest["flagged_transactions"]
+
             return {
                 "total_transactions": total,
                 "flagged_transactions": flagged_count,
-                "file_size_mb": round(file_size / (1024 * 1024), 2)
-            }, None
+                "file_size_mb": round(run_store.run_size(run_id) / (1024 * 1024), 2)
+            }
         except Exception as e:
-            return {"error": f"Error loading file: {str(e)}"}, None
-    
-    result, _ = await asyncio.to_thread(get_summary)
-    return result
+            return {"error": f"Error loading file: {str(e)}"}
+
+    result = await asyncio.to_thread(get_summary)
+    return _cacheable(response, result, run_id)
 
 
 @app.get("/api/run/{run_id}")
 async def get_run(
     run_id: str,
+    request: Request,
+    response: Response,
     limit: Optional[int] = Query(100, description="Limit number of transactions returned (default: 100, max: 1000)"),
     offset: Optional[int] = Query(0, description="Offset for pagination"),
     flagged_only: Optional[bool] = Query(False, description="Return only flagged transactions")
 ):
-    path = os.path.join(OUTPUT_DIR, f"{run_id}.json")
-    if not os.path.exists(path):
+    if not run_store.run_exists(run_id):
         return {"error": "Run not found"}
 
-    # Check file size and warn if too large
-    file_size = os.path.getsize(path)
-    if file_size > 50 * 1024 * 1024:  # > 50MB
+    not_modified = _not_modified(request, run_id)
+    if not_modified:
+        return not_modified
+
+    # Legacy single-file runs have to be parsed whole, so keep the size guard for them
+    if run_store.is_legacy_run(run_id) and run_store.run_size(run_id) > 50 * 1024 * 1024:  # > 50MB
         return {"error": "File too large. Please use smaller limit parameter or /summary endpoint."}
-    
+
     # Enforce maximum limit
     if limit and limit > 1000:
         limit = 1000
 
-    # Load JSON efficiently with error handling
-    def load_and_process_json():
+    # Resolve the page through the index and only read the chunks it covers
+    def load_page():
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if not isinstance(data, list):
-                return {"error": "Invalid data format"}, 0
-            
-            total = len(data)
-            
+            index = run_store.load_index(run_id)
+
+            positions = range(len(index["transaction_id"]))
+
             # Filter flagged transactions if requested
             if flagged_only:
-                data = [r for r in data if r.get("rules")]
-                total = len(data)
-            
+                positions = [i for i in positions if index["rules"][i]]
+
+            total = len(positions)
+
             # Apply pagination
             if limit is not None and limit > 0:
-                data = data[offset:offset + limit]
+                positions = positions[offset:offset + limit]
             elif offset > 0:
-                data = data[offset:]
-            
-            return data, total
+                positions = positions[offset:]
+
+            return run_store.read_rows(run_id, positions), total
         except json.JSONDecodeError as e:
             return {"error": f"Invalid JSON: {str(e)}"}, 0
         except MemoryError:
             return {"error": "File too large to load. Use /summary endpoint or smaller limit."}, 0
         except Exception as e:
             return {"error": f"Error loading file: {str(e)}"}, 0
-    
-    data, total = await asyncio.to_thread(load_and_process_json)
-    
+
+    data, total = await asyncio.to_thread(load_page)
+
     if isinstance(data, dict) and "error" in data:
         return data
-    
-    return {
+
+    return _cacheable(response, {
         "total": total,
         "returned": len(data),
         "offset": offset,
         "limit": limit,
         "transactions": data
-    }
+    }, run_id)
 
 
 @app.get("/api/run/{run_id}/transaction/{txn_id}")
-async def get_transaction(run_id: str, txn_id: int):
-    path = os.path.join(OUTPUT_DIR, f"{run_id}.json")
-    if not os.path.exists(path):
+async def get_transaction(run_id: str, txn_id: int, request: Request, response: Response):
+    if not run_store.run_exists(run_id):
         return {"error": "Run not found"}
 
+    # Look the id up before the conditional check so unknown ids never get a 304
+    try:
+        found = await asyncio.to_thread(run_store.has_transaction, run_id, txn_id)
+    except Exception as e:
+        return {"error": f"Error loading file: {str(e)}"}
+    if not found:
+        return {"error": "Transaction not found"}
+
+    not_modified = _not_modified(request, run_id)
+    if not_modified:
+        return not_modified
+
     def find_transaction():
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if not isinstance(data, list):
-                return {"error": "Invalid data format"}
-            
-            for row in data:
-                if isinstance(row, dict) and row.get("transaction_id") == txn_id:
-                    return row
-            
-            return {"error": "Transaction not found"}
+            row = run_store.find_transaction(run_id, txn_id)
+            if row is None:
+                return {"error": "Transaction not found"}
+            return row
         except Exception as e:
             return {"error": f"Error loading file: {str(e)}"}
-    
+
     result = await asyncio.to_thread(find_transaction)
-    return result
+    return _cacheable(response, result, run_id)
+
+
+def _filter_run(run_id, rule, verification, mcc, state, min_amount, max_amount, flagged_only):
+    df = run_query.load_frame(run_id)
+    return run_query.filter_frame(
+        df,
+        rules=rule,
+        verification=verification,
+        mcc=mcc,
+        state=state,
+        min_amount=min_amount,
+        max_amount=max_amount,
+        flagged_only=flagged_only,
+    )
+
+
+@app.get("/api/run/{run_id}/query")
+async def query_run(
+    run_id: str,
+    request: Request,
+    response: Response,
+    rule: Optional[List[str]] = Query(None, description="Only transactions that triggered any of these rules"),
+    verification: Optional[List[str]] = Query(None, description="Only transactions with any of these verification results"),
+    mcc: Optional[List[int]] = Query(None, description="Only transactions with any of these merchant category codes"),
+    state: Optional[List[str]] = Query(None, description="Only transactions with any of these merchant states"),
+    min_amount: Optional[float] = Query(None, description="Minimum transaction amount"),
+    max_amount: Optional[float] = Query(None, description="Maximum transaction amount"),
+    flagged_only: Optional[bool] = Query(False, description="Return only flagged transactions"),
+    sort_by: Optional[str] = Query(None, description="Sort field (transaction_id, amount, mcc, merchant_state, txn_hour, verification, rule_count)"),
+    descending: Optional[bool] = Query(False, description="Sort in descending order"),
+    limit: Optional[int] = Query(100, description="Limit number of transactions returned (default: 100, max: 1000)"),
+    offset: Optional[int] = Query(0, description="Offset for pagination")
+):
+    """Filter and sort a run server-side using its columnar index"""
+    if not run_store.run_exists(run_id):
+        return {"error": "Run not found"}
+
+    # Validate before the conditional check so bad parameters never get a 304
+    if sort_by is not None and sort_by not in run_query.SORT_FIELDS:
+        return {"error": f"Unknown sort field: {sort_by}"}
+
+    not_modified = _not_modified(request, run_id)
+    if not_modified:
+        return not_modified
+
+    # Enforce maximum limit
+    if limit and limit > 1000:
+        limit = 1000
+
+    def run():
+        try:
+            df = _filter_run(run_id, rule, verification, mcc, state, min_amount, max_amount, flagged_only)
+            positions, total = run_query.query_positions(df, sort_by, descending, offset, limit)
+            return run_store.read_rows(run_id, positions), total
+        except ValueError as e:
+            return {"error": str(e)}, 0
+        except Exception as e:
+            return {"error": f"Error querying run: {str(e)}"}, 0
+
+    data, total = await asyncio.to_thread(run)
+
+    if isinstance(data, dict) and "error" in data:
+        return data
+
+    return _cacheable(response, {
+        "total": total,
+        "returned": len(data),
+        "offset": offset,
+        "limit": limit,
+        "transactions": data
+    }, run_id)
+
+
+@app.get("/api/run/{run_id}/aggregate")
+async def aggregate_run(
+    run_id: str,
+    request: Request,
+    response: Response,
+    group_by: str = Query(..., description="Group field (rule, mcc, merchant_state, txn_hour, verification)"),
+    rule: Optional[List[str]] = Query(None, description="Only transactions that triggered any of these rules"),
+    verification: Optional[List[str]] = Query(None, description="Only transactions with any of these verification results"),
+    mcc: Optional[List[int]] = Query(None, description="Only transactions with any of these merchant category codes"),
+    state: Optional[List[str]] = Query(None, description="Only transactions with any of these merchant states"),
+    min_amount: Optional[float] = Query(None, description="Minimum transaction amount"),
+    max_amount: Optional[float] = Query(None, description="Maximum transaction amount"),
+    flagged_only: Optional[bool] = Query(False, description="Only aggregate flagged transactions")
+):
+    """Group-by aggregates over a run, e.g. hits per rule, per MCC or per hour"""
+    if not run_store.run_exists(run_id):
+        return {"error": "Run not found"}
+
+    # Validate before the conditional check so bad parameters never get a 304
+    if group_by not in run_query.GROUP_BY_FIELDS:
+        return {"error": f"Unknown group_by field: {group_by}"}
+
+    not_modified = _not_modified(request, run_id)
+    if not_modified:
+        return not_modified
+
+    def run():
+        try:
+            df = _filter_run(run_id, rule, verification, mcc, state, min_amount, max_amount, flagged_only)
+            return {
+                "group_by": group_by,
+                "total": len(df),
+                "groups": run_query.aggregate(df, group_by)
+            }
+        except ValueError as e:
+            return {"error": str(e)}
+        except Exception as e:
+            return {"error": f"Error aggregating run: {str(e)}"}
+
+    result = await asyncio.to_thread(run)
+    return _cacheable(response, result, run_id)
+
+
+@app.get("/api/run/{run_id}/diff/{other_run_id}")
+async def diff_runs(
+    run_id: str,
+    other_run_id: str,
+    request: Request,
+    response: Response,
+    change: Optional[str] = Query(None, description="Only return one change type (newly_flagged, newly_unflagged, rules_changed, verification_changed, added, removed)"),
+    limit: Optional[int] = Query(100, description="Limit number of changes returned (default: 100, max: 1000)"),
+    offset: Optional[int] = Query(0, description="Offset for pagination")
+):
+    """Compare two runs using their transaction-id indexes"""
+    for rid in (run_id, other_run_id):
+        if not run_store.run_exists(rid):
+            return {"error": f"Run not found: {rid}"}
+
+    # Validate before the conditional check so bad parameters never get a 304
+    if change is not None and change not in run_store.DIFF_CHANGE_TYPES:
+        return {"error": f"Unknown change type: {change}"}
+
+    not_modified = _not_modified(request, run_id, other_run_id)
+    if not_modified:
+        return not_modified
+
+    # Enforce maximum limit
+    if limit and limit > 1000:
+        limit = 1000
+
+    def compute_diff():
+        try:
+            return run_store.diff_runs(run_id, other_run_id)
+        except Exception as e:
+            return {"error": f"Error comparing runs: {str(e)}"}
+
+    diff = await asyncio.to_thread(compute_diff)
+
+    if isinstance(diff, dict) and "error" in diff:
+        return diff
+
+    # The diff is cached per run pair; only slice it here
+    changes, by_type = diff
+    counts = {t: len(by_type[t]) for t in run_store.DIFF_CHANGE_TYPES}
+
+    if change is not None:
+        changes = by_type[change]
+
+    total = len(changes)
+    if limit is not None and limit > 0:
+        changes = changes[offset:offset + limit]
+    elif offset > 0:
+        changes = changes[offset:]
+
+    return _cacheable(response, {
+        "base_run_id": run_id,
+        "target_run_id": other_run_id,
+        "counts": counts,
+        "total": total,
+        "returned": len(changes),
+        "offset": offset,
+        "limit": limit,
+        "changes": changes
+    }, run_id, other_run_id)
 
 
 if __name__ == "__main__":
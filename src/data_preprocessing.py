@@ -1,15 +1,64 @@
+import numpy as np
 import pandas as pd
 
-def load_raw_data():
-    transactions = pd.read_csv("data/raw/transaction_data_small.csv")
+TRANSACTIONS_PATH = "data/raw/transaction_data_small.csv"
+CARDS_PATH = "data/raw/cards_data.csv"
+USERS_PATH = "data/raw/users_data.csv"
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Fields stored as "$1234.56" in the raw CSVs, per source file
+TRANSACTION_CURRENCY_FIELDS = ["amount"]
+CARD_CURRENCY_FIELDS = ["credit_limit"]
+USER_CURRENCY_FIELDS = ["per_capita_income", "yearly_income", "total_debt"]
+
+def parse_currency(value):
+    """CSV converter for dollar amounts; unparseable values become NaN."""
+    try:
+        return float(value.replace('$', ''))
+    except ValueError:
+        return np.nan
+
+class _CurrencyConverter:
+    """
+    parse_currency that also records whether any raw value was written as a
+    float literal (e.g. "$14.00"), which is what makes pd.to_numeric return
+    float64 rather than int64.
+    """
+
+    def __init__(self):
+        self.float_literal = False
+
+    def __call__(self, value):
+        if not self.float_literal and ('.' in value or 'e' in value or 'E' in value):
+            self.float_literal = True
+        return parse_currency(value)
+
+def _read_csv(path, currency_fields):
+    # Converters parse currency while reading, instead of round-tripping
+    # the parsed column through astype(str) afterwards
+    converters = {col: _CurrencyConverter() for col in currency_fields}
+    df = pd.read_csv(path, converters=converters)
+
+    # Match pd.to_numeric dtypes: int64 only if every raw value was an
+    # integer literal and none failed to parse
+    for col, converter in converters.items():
+        if not converter.float_literal and df[col].notna().all():
+            df[col] = df[col].astype('int64')
+
+    return df
+
+def load_raw_data(transactions_path=TRANSACTIONS_PATH, cards_path=CARDS_PATH, users_path=USERS_PATH):
+    transactions = _read_csv(transactions_path, TRANSACTION_CURRENCY_FIELDS)
+    transactions['date'] = pd.to_datetime(transactions['date'], format=DATE_FORMAT, errors='coerce')
 
     cards = (
-        pd.read_csv("data/raw/cards_data.csv")
+        _read_csv(cards_path, CARD_CURRENCY_FIELDS)
         .rename(columns={"id": "card_id_ref"})
     )
 
     users = (
-        pd.read_csv("data/raw/users_data.csv")
+        _read_csv(users_path, USER_CURRENCY_FIELDS)
         .rename(columns={"id": "user_id_ref"})
     )
 
@@ -17,35 +66,28 @@ def load_raw_data():
 
 def merge_data(transactions, cards, users):
     # Drop client_id from cards to avoid column conflict
-    cards_clean = cards.drop(columns=['client_id'], errors='ignore')
-    
-    df = transactions.merge(
-        cards_clean,
-        left_on="card_id",
-        right_on="card_id_ref",
-        how="left"
+    card_attrs = (
+        cards.drop(columns=['client_id'], errors='ignore')
+        .set_index("card_id_ref", drop=False)
     )
+    user_attrs = users.set_index("user_id_ref", drop=False)
 
-    df = df.merge(
-        users,
-        left_on="client_id",
-        right_on="user_id_ref",
-        how="left"
-    )
+    # Card and user ids are unique, so a left join is a lookup per
+    # transaction. Look both up and concatenate once rather than chaining
+    # two merges, which copies the full frame twice.
+    card_part = card_attrs.reindex(transactions["card_id"].values).set_axis(transactions.index)
+    user_part = user_attrs.reindex(transactions["client_id"].values).set_axis(transactions.index)
 
-    return df
+    return pd.concat([transactions, card_part, user_part], axis=1)
 
 def clean_data(df):
-    df['date'] = pd.to_datetime(df['date'], errors='coerce')
-
-    # Remove dollar signs and convert to numeric
-    df['amount'] = df['amount'].astype(str).str.replace('$', '', regex=False)
-    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+    if not pd.api.types.is_datetime64_any_dtype(df['date']):
+        df['date'] = pd.to_datetime(df['date'], format=DATE_FORMAT, errors='coerce')
 
-    # Convert other numeric fields that may have dollar signs
-    numeric_fields = ["credit_limit", "per_capita_income", "yearly_income", "total_debt"]
+    # Remove dollar signs and convert to numeric, unless already parsed on load
+    numeric_fields = ["amount", "credit_limit", "per_capita_income", "yearly_income", "total_debt"]
     for col in numeric_fields:
-        if col in df.columns:
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
             df[col] = df[col].astype(str).str.replace('$', '', regex=False)
             df[col] = pd.to_numeric(df[col], errors='coerce')
 
@@ -68,4 +110,3 @@ def preprocess():
 
     df.to_csv("data/processed/merged.csv", index=False)
     return df
-
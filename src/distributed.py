@@ -0,0 +1,379 @@
+"""
+Sharded pipeline execution with a coordinator and socket workers.
+
+The coordinator preprocesses the input once, splits it into contiguous
+client_id ranges and sends each shard to a worker. Workers run the
+feature, rule and reasoning stages on their shard independently and send
+the results back. Shards whose worker fails are retried on any worker
+that is still reachable.
+
+Sharding by client_id keeps every per-client feature (rolling windows,
+previous transaction counts, mean amount) inside one shard. The only
+input-wide statistic, the median amount, is computed by the coordinator
+and sent along with each shard.
+
+Workers listen on TCP sockets via multiprocessing.connection and
+authenticate with a shared key taken from VCOTATS_WORKER_AUTHKEY, which
+must be set to the same secret on the coordinator and every worker.
+Messages are pickled, so anyone holding the key can run code on a worker.
+Workers bind to 127.0.0.1 unless --host is given explicitly.
+
+    python -m src.distributed worker --port 6001
+    python -m src.distributed worker --host 0.0.0.0 --port 6001
+    python -m src.distributed coordinator --workers host1:6001,host2:6001
+    python -m src.distributed coordinator --local 4
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import traceback
+import uuid
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, Listener, answer_challenge, deliver_challenge
+
+from src import run_store
+from src.data_preprocessing import preprocess
+from src.pipeline import run_stages
+
+AUTHKEY_ENV = "VCOTATS_WORKER_AUTHKEY"
+DEFAULT_RETRIES = 2
+# Seconds either side waits for the other during connect and handshake,
+# and that a worker waits for the shard once a coordinator is connected
+CONNECT_TIMEOUT = 10
+
+
+def worker_authkey():
+    """Return the shared worker key, failing if it is not configured."""
+    key = os.getenv(AUTHKEY_ENV)
+    if not key:
+        raise RuntimeError(f"{AUTHKEY_ENV} must be set to a shared secret to use pipeline workers")
+    return key.encode()
+
+
+# -----------------------------
+# Worker
+# -----------------------------
+
+def _receive_task(conn, authkey, timeout):
+    """Authenticate a coordinator and read its shard, each within `timeout` seconds."""
+    guarded = _DeadlineConnection(conn, timeout)
+    deliver_challenge(guarded, authkey)
+    answer_challenge(guarded, authkey)
+    if not conn.poll(timeout):
+        raise TimeoutError(f"No shard within {timeout}s")
+    return conn.recv()
+
+
+def serve(host="127.0.0.1", port=6001, authkey=None, ready=None, timeout=CONNECT_TIMEOUT):
+    """
+    Process shards sent by coordinators, one at a time, until killed.
+
+    A client that does not complete the handshake and send its shard within
+    `timeout` seconds is dropped, so a silent connection cannot block the
+    worker. If `ready` is given (a multiprocessing connection), the bound
+    address is sent through it once the worker is listening, so port 0 can
+    be used.
+    """
+    authkey = authkey or worker_authkey()
+    # No authkey on the Listener: its accept() would run the handshake
+    # without a deadline. _receive_task runs it instead.
+    with Listener((host, port)) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                continue
+
+            with conn:
+                try:
+                    task = _receive_task(conn, authkey, timeout)
+                except (OSError, EOFError, AuthenticationError):
+                    # Failed handshake (e.g. wrong authkey) or silent client
+                    continue
+
+                try:
+                    results = run_stages(task["df"], amount_median=task["amount_median"], save=False)
+                    reply = {"ok": True, "results": results}
+                except Exception:
+                    reply = {"ok": False, "error": traceback.format_exc()}
+
+                try:
+                    conn.send(reply)
+                except (OSError, EOFError):
+                    # The coordinator gave up on this shard
+                    continue
+
+
+def start_local_workers(count, authkey=None):
+    """
+    Start `count` worker processes on localhost ephemeral ports.
+
+    Returns (processes, addresses); terminate the processes when done.
+    """
+    authkey = authkey or worker_authkey()
+    processes, addresses = [], []
+    for _ in range(count):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=serve,
+            kwargs={"host": "127.0.0.1", "port": 0, "authkey": authkey, "ready": sender},
+            daemon=True,
+        )
+        process.start()
+        sender.close()
+        addresses.append(receiver.recv())
+        processes.append(process)
+    return processes, addresses
+
+
+# -----------------------------
+# Coordinator
+# -----------------------------
+
+def shard_by_client(df, num_shards):
+    """
+    Split a preprocessed frame into at most `num_shards` contiguous client_id
+    ranges holding roughly equal numbers of transactions.
+
+    Returns a list of (first_client_id, last_client_id, frame), ordered by
+    client_id. Empty shards are dropped.
+    """
+    counts = df.groupby("client_id").size().sort_index()
+    starts = counts.cumsum() - counts
+    shard_of_client = (starts * num_shards // len(df)).astype(int)
+
+    shards = []
+    for _, clients in shard_of_client.groupby(shard_of_client):
+        first, last = clients.index[0], clients.index[-1]
+        mask = df["client_id"].between(first, last)
+        shards.append((int(first), int(last), df[mask].copy()))
+    return shards
+
+
+class WorkerUnreachable(Exception):
+    """The worker could not be connected to; the shard was never sent."""
+
+
+class _DeadlineConnection:
+    """
+    The send_bytes/recv_bytes part of a Connection, with reads that fail if
+    nothing arrives within `timeout` seconds. Enough for the handshake.
+    """
+
+    def __init__(self, conn, timeout):
+        self.conn = conn
+        self.timeout = timeout
+
+    def send_bytes(self, buf):
+        self.conn.send_bytes(buf)
+
+    def recv_bytes(self, maxlength=None):
+        if not self.conn.poll(self.timeout):
+            raise TimeoutError(f"No handshake reply within {self.timeout}s")
+        return self.conn.recv_bytes(maxlength)
+
+
+def _error_line(e):
+    return (str(e).strip().splitlines() or [type(e).__name__])[-1]
+
+
+def _connect(address, authkey, timeout):
+    """
+    Client() with a deadline on the TCP connect and on every handshake
+    read. A worker only answers once it accepts, which it does between
+    shards, so a busy or hung worker fails here instead of blocking.
+    """
+    try:
+        with socket.create_connection(address, timeout=timeout) as sock:
+            sock.setblocking(True)
+            conn = Connection(sock.detach())
+    except OSError as e:
+        raise WorkerUnreachable(_error_line(e)) from e
+
+    try:
+        guarded = _DeadlineConnection(conn, timeout)
+        answer_challenge(guarded, authkey)
+        deliver_challenge(guarded, authkey)
+    except (OSError, EOFError, AuthenticationError) as e:
+        conn.close()
+        raise WorkerUnreachable(_error_line(e)) from e
+    return conn
+
+
+def _run_on_worker(address, task, authkey, timeout, connect_timeout=CONNECT_TIMEOUT):
+    conn = _connect(address, authkey, connect_timeout)
+    with conn:
+        conn.send(task)
+        if timeout is not None and not conn.poll(timeout):
+            raise TimeoutError(f"No reply within {timeout}s")
+        reply = conn.recv()
+    if not reply["ok"]:
+        raise RuntimeError(reply["error"])
+    return reply["results"]
+
+
+def run_sharded_pipeline(workers, num_shards=None, retries=DEFAULT_RETRIES, timeout=None, authkey=None):
+    """
+    Run the full pipeline across worker processes.
+
+    `workers` is a list of (host, port) addresses. Input is split into
+    `num_shards` client_id ranges (default: one per worker). Each shard is
+    attempted up to 1 + `retries` times on workers that accepted it; a
+    worker that cannot be connected to within CONNECT_TIMEOUT is dropped
+    for the rest of the run without using up an attempt. A shard that
+    fails is put back for any worker to pick up. A worker that timed out
+    after `timeout` seconds or whose connection broke mid-shard is dropped
+    as well, since it is still busy with (or lost) the abandoned shard.
+
+    Returns (results, metadata) where results are ordered as full_pipeline
+    would order them and metadata describes the shards for the run manifest.
+    """
+    if not workers:
+        raise ValueError("At least one worker address is required")
+    authkey = authkey or worker_authkey()
+
+    df = preprocess()
+    amount_median = float(df["amount"].median())
+    shards = shard_by_client(df, num_shards or len(workers))
+
+    jobs = queue.Queue()
+    for shard_no in range(len(shards)):
+        jobs.put(shard_no)
+
+    lock = threading.Lock()
+    results = {}
+    attempts = {shard_no: [] for shard_no in range(len(shards))}
+    unreachable = []
+    failed = {}
+
+    def resolved():
+        return len(results) + len(failed) == len(shards)
+
+    def drive(address):
+        worker = f"{address[0]}:{address[1]}"
+        while True:
+            with lock:
+                if resolved():
+                    return
+            try:
+                shard_no = jobs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            task = {"df": shards[shard_no][2], "amount_median": amount_median}
+            try:
+                shard_results = _run_on_worker(address, task, authkey, timeout)
+            except WorkerUnreachable as e:
+                # The shard never reached this worker, so it is not an attempt
+                with lock:
+                    unreachable.append({"worker": worker, "error": str(e)})
+                    jobs.put(shard_no)
+                return
+            except Exception as e:
+                # Timeouts (an OSError) included: the worker keeps running the
+                # abandoned shard and would not accept the retry until done
+                retire = isinstance(e, (OSError, EOFError))
+                with lock:
+                    attempts[shard_no].append({"worker": worker, "error": _error_line(e)})
+                    if len(attempts[shard_no]) > retries:
+                        failed[shard_no] = e
+                    else:
+                        jobs.put(shard_no)
+                if retire:
+                    return
+                continue
+
+            with lock:
+                attempts[shard_no].append({"worker": worker})
+                results[shard_no] = shard_results
+
+    threads = [threading.Thread(target=drive, args=(tuple(a),), daemon=True) for a in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    missing = [shard_no for shard_no in range(len(shards)) if shard_no not in results]
+    if missing:
+        details = "; ".join(
+            f"shard {n}: {attempts[n][-1]['error'] if attempts[n] else 'no reachable workers'}"
+            for n in missing
+        )
+        raise RuntimeError(f"{len(missing)} shard(s) failed: {details}")
+
+    merged = [row for shard_no in range(len(shards)) for row in results[shard_no]]
+    metadata = {
+        "mode": "sharded",
+        "amount_median": amount_median,
+        "unreachable_workers": unreachable,
+        "shards": [
+            {
+                "shard": shard_no,
+                "client_id_range": [first, last],
+                "transactions": len(results[shard_no]),
+                "attempts": attempts[shard_no],
+            }
+            for shard_no, (first, last, _) in enumerate(shards)
+        ],
+    }
+    return merged, metadata
+
+
+def parse_workers(value):
+    """Parse "host:port,host:port" into a list of (host, port) addresses."""
+    addresses = []
+    for item in value.split(","):
+        host, _, port = item.strip().rpartition(":")
+        addresses.append((host or "localhost", int(port)))
+    return addresses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded VCoTATS pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    worker_cmd = sub.add_parser("worker", help="Serve pipeline shards")
+    worker_cmd.add_argument("--host", default="127.0.0.1", help="Interface to bind (use 0.0.0.0 to accept remote coordinators)")
+    worker_cmd.add_argument("--port", type=int, default=6001)
+
+    coord_cmd = sub.add_parser("coordinator", help="Run the pipeline across workers and save the run")
+    target = coord_cmd.add_mutually_exclusive_group(required=True)
+    target.add_argument("--workers", type=parse_workers, help="Comma-separated host:port list")
+    target.add_argument("--local", type=int, help="Start this many local worker processes")
+    coord_cmd.add_argument("--shards", type=int, default=None)
+    coord_cmd.add_argument("--retries", type=int, default=DEFAULT_RETRIES)
+    coord_cmd.add_argument("--timeout", type=float, default=None, help="Seconds to wait for one shard")
+
+    args = parser.parse_args()
+
+    # Fail before doing any work if the shared key is missing
+    try:
+        worker_authkey()
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    if args.command == "worker":
+        print(f"Worker listening on {args.host}:{args.port}")
+        serve(args.host, args.port)
+    else:
+        processes = []
+        workers = args.workers
+        if args.local:
+            processes, workers = start_local_workers(args.local)
+        try:
+            results, metadata = run_sharded_pipeline(workers, args.shards, args.retries, args.timeout)
+        finally:
+            for process in processes:
+                process.terminate()
+
+        run_id = str(uuid.uuid4())
+        run_store.save_run(run_id, results, metadata=metadata)
+        flagged = sum(1 for r in results if r["rules"])
+        print(f"Run {run_id}: {len(results)} transactions, {flagged} flagged, {len(metadata['shards'])} shards")
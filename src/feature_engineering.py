@@ -1,7 +1,12 @@
 import pandas as pd
 import numpy as np
 
-def add_features(df):
+def add_features(df, amount_median=None, save=True):
+    # When the frame is one shard of a larger input, pass the median amount
+    # of the full input so high_amount_flag matches an unsharded run
+    if amount_median is None:
+        amount_median = df['amount'].median()
+
     df['txn_hour'] = df['date'].dt.hour
     df['txn_day'] = df['date'].dt.dayofweek
 
@@ -9,7 +14,7 @@ def add_features(df):
     df['account_age_days'] = (pd.to_datetime('2025-01-01') - pd.to_datetime(df['acct_open_date'], errors='coerce')).dt.days
 
     df['debt_to_income_ratio'] = df['total_debt'] / df['yearly_income']
-    df['high_amount_flag'] = df['amount'] > (df['amount'].median() * 3)
+    df['high_amount_flag'] = df['amount'] > (amount_median * 3)
 
     df['error_flag'] = df['errors'].notnull()
 
@@ -123,6 +128,7 @@ def add_features(df):
     
     df['dormant_sudden_activity'] = (df['account_age_days'] > 300) & (df['previous_tx_count'] == 0)
 
-    df.to_csv("data/processed/enriched.csv", index=False)
+    if save:
+        df.to_csv("data/processed/enriched.csv", index=False)
     return df
 
@@ -8,9 +8,20 @@ from src.verifier import verify_reasoning
 
 def full_pipeline():
     df = preprocess()
-    df = add_features(df)
-    df = run_rule_engine(df)
+    return run_stages(df)
 
+def run_stages(df, amount_median=None, save=True):
+    """
+    Run the feature, rule and reasoning stages over a preprocessed frame.
+
+    Used on the whole input by full_pipeline and on one client_id shard at a
+    time by src/distributed.py workers.
+    """
+    df = add_features(df, amount_median=amount_median, save=save)
+    df = run_rule_engine(df, save=save)
+    return build_results(df)
+
+def build_results(df):
     results = []
 
     for _, row in df.iterrows():
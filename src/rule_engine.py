@@ -83,9 +83,10 @@ def apply_rules(row):
 
     return rules
 
-def run_rule_engine(df):
+def run_rule_engine(df, save=True):
     df['rules_triggered'] = df.apply(apply_rules, axis=1)
     df['flagged'] = df['rules_triggered'].apply(lambda x: len(x) > 0)
-    df.to_csv("data/processed/flagged.csv", index=False)
+    if save:
+        df.to_csv("data/processed/flagged.csv", index=False)
     return df
 
@@ -0,0 +1,149 @@
+from functools import lru_cache
+
+import pandas as pd
+
+from src import run_store
+
+# Completed runs are immutable, so their query frames can be kept around
+FRAME_CACHE_SIZE = 8
+
+# One boolean column per triggered rule, named RULE_PREFIX + rule id
+RULE_PREFIX = "rule:"
+
+SORT_FIELDS = [
+    "transaction_id", "amount", "mcc", "merchant_state",
+    "txn_hour", "verification", "rule_count",
+]
+
+GROUP_BY_FIELDS = ["rule", "mcc", "merchant_state", "txn_hour", "verification"]
+
+
+@run_store.register_cache
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def load_frame(run_id):
+    """
+    Load the columnar index of a run as a DataFrame (one row per
+    transaction, in storage order).
+
+    Rule lists are expanded into one boolean column per rule, so rule
+    filters and per-rule aggregates stay vectorized. The returned frame is
+    shared between callers and must not be modified in place.
+    """
+    df = pd.DataFrame(run_store.load_index(run_id), columns=run_store.INDEX_FIELDS)
+    # map(len) rather than .str.len(): a run without transactions gives
+    # an empty float column that the .str accessor rejects
+    df["rule_count"] = df["rules"].map(len).astype("int64")
+
+    hits = pd.get_dummies(df["rules"].explode(), prefix="", prefix_sep="", dtype=bool)
+    hits = hits.groupby(level=0).max().reindex(df.index, fill_value=False)
+    hits.columns = [RULE_PREFIX + rule for rule in hits.columns]
+
+    return pd.concat([df.drop(columns=["rules"]), hits], axis=1)
+
+
+def rule_columns(df):
+    return [c for c in df.columns if c.startswith(RULE_PREFIX)]
+
+
+def filter_frame(
+    df,
+    rules=None,
+    verification=None,
+    mcc=None,
+    state=None,
+    min_amount=None,
+    max_amount=None,
+    flagged_only=False,
+):
+    """
+    Filter index rows. List filters match any of the given values; a
+    transaction matches `rules` if it triggered at least one of them.
+    """
+    mask = pd.Series(True, index=df.index)
+
+    if flagged_only:
+        mask &= df["rule_count"] > 0
+    if rules:
+        columns = [RULE_PREFIX + rule for rule in rules if RULE_PREFIX + rule in df.columns]
+        mask &= df[columns].any(axis=1)
+    if verification:
+        mask &= df["verification"].isin(verification)
+    if mcc:
+        mask &= df["mcc"].isin(mcc)
+    if state:
+        mask &= df["merchant_state"].isin(state)
+    if min_amount is not None:
+        mask &= df["amount"] >= min_amount
+    if max_amount is not None:
+        mask &= df["amount"] <= max_amount
+
+    return df[mask]
+
+
+def query_positions(df, sort_by=None, descending=False, offset=0, limit=100):
+    """
+    Sort filtered index rows and return (page row positions, total matches).
+    """
+    total = len(df)
+
+    if sort_by is not None:
+        if sort_by not in SORT_FIELDS:
+            raise ValueError(f"Unknown sort field: {sort_by}")
+        df = df.sort_values(sort_by, ascending=not descending, kind="stable", na_position="last")
+
+    positions = df.index
+    if limit is not None and limit > 0:
+        positions = positions[offset:offset + limit]
+    elif offset > 0:
+        positions = positions[offset:]
+
+    return positions.tolist(), total
+
+
+def aggregate(df, group_by):
+    """
+    Group filtered index rows and return per-group transaction counts,
+    flagged counts and amount totals, largest groups first.
+
+    Grouping by rule counts a transaction once for every rule it triggered.
+    """
+    if group_by not in GROUP_BY_FIELDS:
+        raise ValueError(f"Unknown group_by field: {group_by}")
+
+    if group_by == "rule":
+        hits = df[rule_columns(df)]
+        counts = hits.sum()
+        totals = hits.mul(df["amount"], axis=0).sum()
+        grouped = pd.DataFrame({
+            "count": counts,
+            "flagged": counts,
+            "total_amount": totals,
+            "avg_amount": totals / counts,
+        })
+        grouped = grouped[grouped["count"] > 0]
+        grouped.index = grouped.index.str[len(RULE_PREFIX):]
+    else:
+        grouped = (
+            df.assign(flagged=df["rule_count"] > 0)
+            .dropna(subset=[group_by])
+            .groupby(group_by)
+            .agg(
+                count=("transaction_id", "size"),
+                flagged=("flagged", "sum"),
+                total_amount=("amount", "sum"),
+                avg_amount=("amount", "mean"),
+            )
+        )
+
+    grouped = grouped.sort_values("count", ascending=False, kind="stable")
+
+    return [
+        {
+            "key": key.item() if hasattr(key, "item") else key,
+            "count": int(row["count"]),
+            "flagged": int(row["flagged"]),
+            "total_amount": round(float(row["total_amount"]), 2),
+            "avg_amount": round(float(row["avg_amount"]), 2),
+        }
+        for key, row in grouped.iterrows()
+    ]
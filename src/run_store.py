@@ -0,0 +1,450 @@
+import gzip
+import json
+import os
+import shutil
+import sys
+from functools import lru_cache
+
+RUNS_DIR = "outputs/verified_chains"
+
+# Run storage layout (one directory per run):
+#   {run_id}/manifest.json       - counts, column order and chunk offsets
+#   {run_id}/dimensions.json.gz  - deduplicated card and user records
+#   {run_id}/transactions.bin    - gzip members of CHUNK_SIZE normalized rows
+#   {run_id}/index.json          - columnar transaction-id index
+# Runs written before this layout are single {run_id}.json dumps, optionally
+# with a {run_id}.index.json sidecar. Both are readable.
+STORAGE_FORMAT = 1
+CHUNK_SIZE = 1000
+COMPRESS_LEVEL = 6
+
+MANIFEST_FILE = "manifest.json"
+DIMENSIONS_FILE = "dimensions.json.gz"
+TRANSACTIONS_FILE = "transactions.bin"
+INDEX_FILE = "index.json"
+# Suffix of the scratch directory a run is written to before being renamed
+TMP_SUFFIX = ".tmp"
+
+# Completed runs are immutable, so parsed run data is cached in-process.
+# Sizes are entry counts; a decoded chunk holds CHUNK_SIZE transactions.
+RUN_CACHE_SIZE = 16
+INDEX_CACHE_SIZE = 4
+CHUNK_CACHE_SIZE = 64
+LEGACY_CACHE_SIZE = 2
+DIFF_CACHE_SIZE = 4
+
+# Caches kept by other modules over run data (e.g. run_query frames),
+# cleared together with the caches here
+_external_caches = []
+
+# Per-transaction fields kept in the run index. The index is stored
+# column-wise next to the run data so cross-run and filter/aggregate
+# queries never need to parse the full transaction dump.
+INDEX_FIELDS = [
+    "transaction_id", "rules", "verification",
+    "amount", "mcc", "merchant_state", "txn_hour",
+]
+
+# Card and user attributes repeat for every transaction of the same card or
+# client. They are stored once per run and referenced from each row through
+# the given reference field.
+DIMENSIONS = {
+    "cards": ("_card", [
+        "card_id_ref", "card_brand", "card_type", "card_number", "expires",
+        "cvv", "has_chip", "num_cards_issued", "credit_limit",
+        "acct_open_date", "year_pin_last_changed", "card_on_dark_web",
+    ]),
+    "users": ("_user", [
+        "user_id_ref", "current_age", "retirement_age", "birth_year",
+        "birth_month", "gender", "address", "latitude", "longitude",
+        "per_capita_income", "yearly_income", "total_debt", "credit_score",
+        "num_credit_cards",
+    ]),
+}
+
+
+def run_dir(run_id):
+    return os.path.join(RUNS_DIR, run_id)
+
+
+def legacy_run_path(run_id):
+    return os.path.join(RUNS_DIR, f"{run_id}.json")
+
+
+def legacy_index_path(run_id):
+    return os.path.join(RUNS_DIR, f"{run_id}.index.json")
+
+
+def is_legacy_run(run_id):
+    return (
+        not os.path.exists(os.path.join(run_dir(run_id), MANIFEST_FILE))
+        and os.path.exists(legacy_run_path(run_id))
+    )
+
+
+def run_exists(run_id):
+    return (
+        os.path.exists(os.path.join(run_dir(run_id), MANIFEST_FILE))
+        or os.path.exists(legacy_run_path(run_id))
+    )
+
+
+def run_size(run_id):
+    """Size of a run on disk, in bytes."""
+    if is_legacy_run(run_id):
+        return os.path.getsize(legacy_run_path(run_id))
+    path = run_dir(run_id)
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def list_run_ids():
+    """Return run ids sorted by modification time (newest first)."""
+    runs = {}
+    for name in os.listdir(RUNS_DIR):
+        # Runs still being written by save_run
+        if name.endswith(TMP_SUFFIX):
+            continue
+        path = os.path.join(RUNS_DIR, name)
+        manifest = os.path.join(path, MANIFEST_FILE)
+        if os.path.isdir(path) and os.path.exists(manifest):
+            runs[name] = os.path.getmtime(manifest)
+        elif name.endswith(".json") and not name.endswith(".index.json"):
+            runs.setdefault(name[:-len(".json")], os.path.getmtime(path))
+    return sorted(runs, key=runs.get, reverse=True)
+
+
+def build_index(results):
+    """Build the columnar transaction-id index for a list of run results."""
+    index = {field: [] for field in INDEX_FIELDS}
+    for row in results:
+        if not isinstance(row, dict) or "transaction_id" not in row:
+            continue
+        for field in INDEX_FIELDS:
+            index[field].append(row.get(field))
+        index["rules"][-1] = list(index["rules"][-1] or [])
+    return index
+
+
+def _normalize(results):
+    """
+    Split run results into dimension tables and slim transaction rows.
+
+    Identical card/user attribute sets are stored once and referenced by
+    position, so a row whose attributes differ from other rows of the same
+    card or client still round-trips exactly.
+    """
+    columns = []
+    layouts = set()
+    tables = {name: [] for name in DIMENSIONS}
+    refs = {name: {} for name in DIMENSIONS}
+    rows = []
+
+    for record in results:
+        row = dict(record)
+
+        # Rows skip null fields, so merge each row's key order into the
+        # run-wide column order instead of appending unseen keys at the end
+        layout = tuple(record)
+        if layout not in layouts:
+            layouts.add(layout)
+            pos = 0
+            for key in layout:
+                if key in columns:
+                    pos = columns.index(key) + 1
+                else:
+                    columns.insert(pos, key)
+                    pos += 1
+
+        for name, (ref_field, fields) in DIMENSIONS.items():
+            attrs = {f: row.pop(f) for f in fields if f in row}
+            if not attrs:
+                continue
+            key = json.dumps(attrs, sort_keys=True)
+            if key not in refs[name]:
+                refs[name][key] = len(tables[name])
+                tables[name].append(attrs)
+            row[ref_field] = refs[name][key]
+
+        rows.append(row)
+
+    return columns, tables, rows
+
+
+def _denormalize(row, tables, columns):
+    merged = dict(row)
+    for name, (ref_field, _) in DIMENSIONS.items():
+        ref = merged.pop(ref_field, None)
+        if ref is not None:
+            merged.update(tables[name][ref])
+    return {k: merged[k] for k in columns if k in merged}
+
+
+def _compress(obj):
+    data = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+
+
+def save_run(run_id, results, metadata=None):
+    """
+    Write a run in the chunked storage format. `metadata` (e.g. how the
+    pipeline was executed) is recorded in the manifest as-is.
+    """
+    os.makedirs(RUNS_DIR, exist_ok=True)
+    # Only a rewrite of an existing run (e.g. a migration) can make cached
+    # entries stale; a new run id has nothing cached yet
+    rewrite = os.path.exists(run_dir(run_id)) or os.path.exists(legacy_run_path(run_id))
+
+    columns, tables, rows = _normalize(results)
+    index = build_index(results)
+
+    # Write into a scratch directory and rename it into place, so readers
+    # never see a partially written run
+    tmp_dir = run_dir(run_id) + TMP_SUFFIX
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    chunks = []
+    with open(os.path.join(tmp_dir, TRANSACTIONS_FILE), "wb") as f:
+        for start in range(0, len(rows), CHUNK_SIZE):
+            blob = _compress(rows[start:start + CHUNK_SIZE])
+            chunks.append([f.tell(), len(blob)])
+            f.write(blob)
+
+    with open(os.path.join(tmp_dir, DIMENSIONS_FILE), "wb") as f:
+        f.write(_compress(tables))
+
+    with open(os.path.join(tmp_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f)
+
+    manifest = {
+        "format": STORAGE_FORMAT,
+        "run_id": run_id,
+        "total_transactions": len(results),
+        "flagged_transactions": sum(1 for rules in index["rules"] if rules),
+        "columns": columns,
+        "chunk_size": CHUNK_SIZE,
+        "chunks": chunks,
+        "metadata": metadata or {},
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(run_dir(run_id), ignore_errors=True)
+    os.rename(tmp_dir, run_dir(run_id))
+    if rewrite:
+        clear_caches()
+
+
+@lru_cache(maxsize=RUN_CACHE_SIZE)
+def load_manifest(run_id):
+    with open(os.path.join(run_dir(run_id), MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=RUN_CACHE_SIZE)
+def load_dimensions(run_id):
+    with open(os.path.join(run_dir(run_id), DIMENSIONS_FILE), "rb") as f:
+        return json.loads(gzip.decompress(f.read()))
+
+
+@lru_cache(maxsize=LEGACY_CACHE_SIZE)
+def load_legacy_run(run_id):
+    with open(legacy_run_path(run_id), "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError("Invalid data format")
+    return data
+
+
+@lru_cache(maxsize=INDEX_CACHE_SIZE)
+def load_index(run_id):
+    """
+    Load the transaction-id index of a run.
+
+    Indexes that are missing, or that predate some of INDEX_FIELDS, are
+    rebuilt from the run data once and persisted, so later lookups stay
+    cheap.
+    """
+    if is_legacy_run(run_id):
+        path = legacy_index_path(run_id)
+    else:
+        path = os.path.join(run_dir(run_id), INDEX_FILE)
+
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if all(field in index for field in INDEX_FIELDS):
+            return index
+
+    index = build_index(read_run(run_id))
+    with open(path, "w") as f:
+        json.dump(index, f)
+    return index
+
+
+@lru_cache(maxsize=INDEX_CACHE_SIZE)
+def _txn_positions(run_id):
+    return {txn_id: i for i, txn_id in enumerate(load_index(run_id)["transaction_id"])}
+
+
+@lru_cache(maxsize=CHUNK_CACHE_SIZE)
+def read_chunk(run_id, chunk_no):
+    """Read one chunk of normalized rows from a run."""
+    offset, length = load_manifest(run_id)["chunks"][chunk_no]
+    with open(os.path.join(run_dir(run_id), TRANSACTIONS_FILE), "rb") as f:
+        f.seek(offset)
+        return json.loads(gzip.decompress(f.read(length)))
+
+
+def read_rows(run_id, positions):
+    """
+    Return the denormalized transactions stored at the given row positions.
+
+    Only the chunks covering the requested positions are decompressed.
+    """
+    if is_legacy_run(run_id):
+        data = load_legacy_run(run_id)
+        return [data[p] for p in positions]
+
+    manifest = load_manifest(run_id)
+    tables = load_dimensions(run_id)
+    chunk_size = manifest["chunk_size"]
+
+    chunks = {}
+    rows = []
+    for p in positions:
+        chunk_no = p // chunk_size
+        if chunk_no not in chunks:
+            chunks[chunk_no] = read_chunk(run_id, chunk_no)
+        row = chunks[chunk_no][p % chunk_size]
+        rows.append(_denormalize(row, tables, manifest["columns"]))
+    return rows
+
+
+def read_run(run_id):
+    """Return every transaction of a run, denormalized."""
+    if is_legacy_run(run_id):
+        return load_legacy_run(run_id)
+    return read_rows(run_id, range(load_manifest(run_id)["total_transactions"]))
+
+
+def has_transaction(run_id, txn_id):
+    return txn_id in _txn_positions(run_id)
+
+
+def find_transaction(run_id, txn_id):
+    """Look up one transaction through the index; None if it is not in the run."""
+    position = _txn_positions(run_id).get(txn_id)
+    if position is None:
+        return None
+    return read_rows(run_id, [position])[0]
+
+
+def migrate_run(run_id):
+    """Rewrite a legacy single-file run in the chunked storage format."""
+    save_run(run_id, load_legacy_run(run_id))
+    os.remove(legacy_run_path(run_id))
+    if os.path.exists(legacy_index_path(run_id)):
+        os.remove(legacy_index_path(run_id))
+    clear_caches()
+
+
+def register_cache(cached):
+    """Have clear_caches() also clear an lru_cache'd function of another module."""
+    _external_caches.append(cached)
+    return cached
+
+
+def clear_caches():
+    """Drop cached run data, e.g. after a run was rewritten on disk."""
+    for cached in (load_manifest, load_dimensions, load_legacy_run,
+                   load_index, _txn_positions, read_chunk, diff_runs,
+                   *_external_caches):
+        cached.cache_clear()
+
+
+def _index_by_txn(index):
+    return {
+        txn_id: {"rules": rules, "verification": verification}
+        for txn_id, rules, verification in zip(
+            index["transaction_id"], index["rules"], index["verification"]
+        )
+    }
+
+
+DIFF_CHANGE_TYPES = [
+    "newly_flagged",
+    "newly_unflagged",
+    "rules_changed",
+    "verification_changed",
+    "added",
+    "removed",
+]
+
+
+@lru_cache(maxsize=DIFF_CACHE_SIZE)
+def diff_runs(base_run_id, target_run_id):
+    """
+    Compare two runs transaction by transaction using their indexes.
+
+    Returns (changes, by_type). `changes` is sorted by transaction id; each
+    change lists every change type that applies, along with the base and
+    target rules/verification (None when the transaction is missing in a
+    run). `by_type` maps each of DIFF_CHANGE_TYPES to the changes of that
+    type, in the same order.
+
+    Both runs are immutable, so the result is cached per pair and pages are
+    sliced from it. Callers must not modify it.
+    """
+    base = _index_by_txn(load_index(base_run_id))
+    target = _index_by_txn(load_index(target_run_id))
+
+    changes = []
+    for txn_id in sorted(base.keys() | target.keys()):
+        before = base.get(txn_id)
+        after = target.get(txn_id)
+
+        if before is None:
+            types = ["added"]
+        elif after is None:
+            types = ["removed"]
+        else:
+            types = []
+            was_flagged = bool(before["rules"])
+            is_flagged = bool(after["rules"])
+            if is_flagged and not was_flagged:
+                types.append("newly_flagged")
+            elif was_flagged and not is_flagged:
+                types.append("newly_unflagged")
+            if sorted(before["rules"]) != sorted(after["rules"]):
+                types.append("rules_changed")
+            if before["verification"] != after["verification"]:
+                types.append("verification_changed")
+
+        if types:
+            changes.append({
+                "transaction_id": txn_id,
+                "changes": types,
+                "base": before,
+                "target": after,
+            })
+
+    by_type = {t: [] for t in DIFF_CHANGE_TYPES}
+    for c in changes:
+        for t in c["changes"]:
+            by_type[t].append(c)
+
+    return changes, by_type
+
+
+if __name__ == "__main__":
+    # python -m src.run_store migrate [run_id ...]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python -m src.run_store migrate [run_id ...]")
+        sys.exit(1)
+
+    run_ids = sys.argv[2:] or [r for r in list_run_ids() if is_legacy_run(r)]
+    for run_id in run_ids:
+        before = run_size(run_id)
+        migrate_run(run_id)
+        print(f"{run_id}: {before} -> {run_size(run_id)} bytes")